@@ -15,7 +15,7 @@
 
 from typing import List, Tuple, Dict, Iterator, Optional
 
-import math
+import itertools
 import numpy as np
 import networkx as nx
 
@@ -32,37 +32,58 @@ def IsTopologyEquivalent(topo1: nx.DiGraph, topo2: nx.DiGraph) -> bool:
         return False
     if topo1.number_of_edges() != topo2.number_of_edges():
         return False
-    A1 = nx.to_numpy_matrix(topo1).ravel()
-    A2 = nx.to_numpy_matrix(topo2).ravel()
-    return (A1 == A2).all()
+    # Compare the weighted adjacency node by node, which is O(E) and never
+    # materializes an N x N matrix.
+    for node, neighbors in topo1.adjacency():
+        if node not in topo2:
+            return False
+        other_neighbors = topo2.succ[node]
+        if neighbors.keys() != other_neighbors.keys():
+            return False
+        for neighbor, edge_data in neighbors.items():
+            if edge_data.get('weight', 1.0) != other_neighbors[neighbor].get('weight', 1.0):
+                return False
+    return True
 
 
 def GetRecvWeights(topo: nx.DiGraph, rank: int) -> Tuple[float, Dict[int, float]]:
     """Return a Tuple of self_weight and neighbor_weights for receiving dictionary."""
-    weight_matrix = nx.to_numpy_array(topo)
     self_weight = 0.0
     neighbor_weights = {}
-    for src_rank in topo.predecessors(rank):
+    # Read the weights from the adjacency directly instead of building the dense matrix.
+    for src_rank, edge_data in topo.pred[rank].items():
         if src_rank == rank:
-            self_weight = weight_matrix[src_rank, rank]
+            self_weight = edge_data.get('weight', 1.0)
         else:
-            neighbor_weights[src_rank] = weight_matrix[src_rank, rank]
+            neighbor_weights[src_rank] = edge_data.get('weight', 1.0)
     return self_weight, neighbor_weights
 
 
 def GetSendWeights(topo: nx.DiGraph, rank: int) -> Tuple[float, Dict[int, float]]:
     """Return a Tuple of self_weight and neighbor_weights for sending dictionary."""
-    weight_matrix = nx.to_numpy_array(topo)
     self_weight = 0.0
     neighbor_weights = {}
-    for recv_rank in topo.successors(rank):
+    for recv_rank, edge_data in topo.succ[rank].items():
         if recv_rank == rank:
-            self_weight = weight_matrix[rank, recv_rank]
+            self_weight = edge_data.get('weight', 1.0)
         else:
-            neighbor_weights[recv_rank] = weight_matrix[rank, recv_rank]
+            neighbor_weights[recv_rank] = edge_data.get('weight', 1.0)
     return self_weight, neighbor_weights
 
 
+def _digraph_from_dense(topo: np.ndarray) -> nx.DiGraph:
+    """Build the weighted DiGraph of a dense weight matrix from its nonzero entries only.
+
+    Equivalent to nx.from_numpy_array(topo, create_using=nx.DiGraph), but it does not
+    visit all N^2 entries in Python, which matters for the sparse topologies here.
+    """
+    rows, cols = np.nonzero(topo)
+    G = nx.DiGraph()
+    G.add_nodes_from(range(topo.shape[0]))
+    G.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), topo[rows, cols].tolist()))
+    return G
+
+
 def ExponentialTwoGraph(size: int) -> nx.DiGraph:
     """Generate graph topology such that each points only
     connected to a point such that the index difference is the power of 2.
@@ -80,20 +101,22 @@ def ExponentialTwoGraph(size: int) -> nx.DiGraph:
     assert size > 0
     x = np.array([1.0 if i & (i - 1) == 0 else 0 for i in range(size)])
     x /= x.sum()
-    topo = np.empty((size, size))
-    for i in range(size):
-        topo[i] = np.roll(x, i)
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    # topo[i] = np.roll(x, i), built as a single circulant gather.
+    j = np.arange(size)
+    topo = x[(j[None, :] - j[:, None]) % size]
+    return _digraph_from_dense(topo)
 
 
 def isPowerOf(x, base):
     assert isinstance(base, int), "Base has to be a integer."
     assert base > 1, "Base has to a interger larger than 1."
     assert x > 0
-    if (base ** int(math.log(x, base))) == x:
-        return True
-    return False
+    if base == 2:
+        return x & (x - 1) == 0
+    # Exact integer check; avoids the float rounding of math.log (e.g. log(243, 3) < 5).
+    while x % base == 0:
+        x //= base
+    return x == 1
 
 
 def ExponentialGraph(size: int, base: int = 2) -> nx.DiGraph:
@@ -118,11 +141,9 @@ def ExponentialGraph(size: int, base: int = 2) -> nx.DiGraph:
             x.append(0.0)
     x = np.array(x)
     x /= x.sum()
-    topo = np.empty((size, size))
-    for i in range(size):
-        topo[i] = np.roll(x, i)
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    j = np.arange(size)
+    topo = x[(j[None, :] - j[:, None]) % size]
+    return _digraph_from_dense(topo)
 
 
 def SymmetricExponentialGraph(size: int, base: int = 4) -> nx.DiGraph:
@@ -150,11 +171,9 @@ def SymmetricExponentialGraph(size: int, base: int = 4) -> nx.DiGraph:
             x.append(0.0)
     x = np.array(x)
     x /= x.sum()
-    topo = np.empty((size, size))
-    for i in range(size):
-        topo[i] = np.roll(x, i)
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    j = np.arange(size)
+    topo = x[(j[None, :] - j[:, None]) % size]
+    return _digraph_from_dense(topo)
 
 
 def MeshGrid2DGraph(size: int, shape: Optional[Tuple[int, int]] = None) -> nx.DiGraph:
@@ -187,28 +206,26 @@ def MeshGrid2DGraph(size: int, shape: Optional[Tuple[int, int]] = None) -> nx.Di
         shape = (i, size//i)
     nrow, ncol = shape
     assert size == nrow*ncol, "The shape doesn't match the size provided."
-    topo = np.zeros((size, size))
-    for i in range(size):
-        topo[i][i] = 1.0
-        if (i+1) % ncol != 0:
-            topo[i][i+1] = 1.0
-            topo[i+1][i] = 1.0
-        if i+ncol < size:
-            topo[i][i+ncol] = 1.0
-            topo[i+ncol][i] = 1.0
+    # Connectivity mask; the weights are only materialized as float64 below.
+    adjacency = np.eye(size, dtype=bool)
+    # Horizontal edges: i <-> i+1 unless i+1 starts a new row.
+    i = np.arange(size - 1)
+    i = i[(i + 1) % ncol != 0]
+    adjacency[i, i + 1] = adjacency[i + 1, i] = True
+    # Vertical edges: i <-> i+ncol.
+    i = np.arange(size - ncol)
+    adjacency[i, i + ncol] = adjacency[i + ncol, i] = True
 
     # According to Hasting rule (Policy 1) in https://arxiv.org/pdf/1702.05122.pdf
     # The neighbor definition in the paper is different from our implementation,
     # which includes the self node.
-    topo_neighbor_with_self = [np.nonzero(topo[i])[0] for i in range(size)]
-    for i in range(size):
-        for j in topo_neighbor_with_self[i]:
-            if i != j:
-                topo[i][j] = 1.0/max(len(topo_neighbor_with_self[i]),
-                                     len(topo_neighbor_with_self[j]))
-        topo[i][i] = 2.0-topo[i].sum()
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    degree = adjacency.sum(axis=1)
+    rows, cols = np.nonzero(adjacency)
+    topo = np.zeros((size, size))
+    topo[rows, cols] = 1.0 / np.maximum(degree[rows], degree[cols])
+    np.fill_diagonal(topo, 1.0)
+    np.fill_diagonal(topo, 2.0 - topo.sum(axis=1))
+    return _digraph_from_dense(topo)
 
 
 def StarGraph(size: int, center_rank: int = 0) -> nx.DiGraph:
@@ -228,13 +245,10 @@ def StarGraph(size: int, center_rank: int = 0) -> nx.DiGraph:
         >>> nx.draw_spring(G)
     """
     assert size > 0
-    topo = np.zeros((size, size))
-    for i in range(size):
-        topo[i, i] = 1 - 1 / size
-        topo[center_rank, i] = 1 / size
-        topo[i, center_rank] = 1 / size
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    topo = np.eye(size) * (1 - 1 / size)
+    topo[center_rank, :] = 1 / size
+    topo[:, center_rank] = 1 / size
+    return _digraph_from_dense(topo)
 
 
 def RingGraph(size: int, connect_style: int = 0) -> nx.DiGraph:
@@ -257,9 +271,9 @@ def RingGraph(size: int, connect_style: int = 0) -> nx.DiGraph:
         "connect_style has to be int between 0 and 2, where 1 " \
         "for bi-connection, 1 for left connection, 2 for right connection."
     if size == 1:
-        return nx.from_numpy_array(np.array([[1.0]]), create_using=nx.DiGraph)
+        return _digraph_from_dense(np.array([[1.0]]))
     if size == 2:
-        return nx.from_numpy_array(np.array([[0.5, 0.5], [0.5, 0.5]]), create_using=nx.DiGraph)
+        return _digraph_from_dense(np.array([[0.5, 0.5], [0.5, 0.5]]))
 
     x = np.zeros(size)
     x[0] = 0.5
@@ -274,11 +288,9 @@ def RingGraph(size: int, connect_style: int = 0) -> nx.DiGraph:
     else:
         raise ValueError("Connect_style has to be int between 0 and 2")
 
-    topo = np.empty((size, size))
-    for i in range(size):
-        topo[i] = np.roll(x, i)
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    j = np.arange(size)
+    topo = x[(j[None, :] - j[:, None]) % size]
+    return _digraph_from_dense(topo)
 
 
 def FullyConnectedGraph(size: int) -> nx.DiGraph:
@@ -295,21 +307,15 @@ def FullyConnectedGraph(size: int) -> nx.DiGraph:
         >>> nx.draw_spring(G)
     """
     assert size > 0
-    x = np.array([1/size] * size)
-    topo = np.empty((size, size))
-    for i in range(size):
-        topo[i] = np.roll(x, i)
-    G = nx.from_numpy_array(topo, create_using=nx.DiGraph)
-    return G
+    topo = np.full((size, size), 1/size)
+    return _digraph_from_dense(topo)
 
 
 def IsRegularGraph(topo: nx.DiGraph) -> bool:
     """Dtermine a graph is regular or not, i.e. all nodes have the same degree."""
-    degree = topo.degree(0)
-    for rank in range(1, topo.number_of_nodes()):
-        if topo.degree(rank) != degree:
-            return False
-    return True
+    degrees = np.fromiter((d for _, d in topo.degree()), dtype=np.int64,
+                          count=topo.number_of_nodes())
+    return bool(degrees.min() == degrees.max())
 
 
 def GetDynamicSendRecvRanks(
@@ -335,23 +341,38 @@ def GetDynamicSendRecvRanks(
     size = topo.number_of_nodes()
     sorted_send_ranks = []
     for rank in range(size):
-        sorted_ranks = sorted(topo.successors(rank),
-                              key=lambda r, rk=rank: r-rk if r >= rk else r-rk+size)
+        # The clock-wise distance from rank is (r - rank) % size.
+        successors = np.fromiter(topo.successors(rank), dtype=np.int64)
+        sorted_ranks = successors[np.argsort((successors - rank) % size)]
         if sorted_ranks[0] == rank:
             sorted_ranks = sorted_ranks[1:]  # remove the self-loop
         sorted_send_ranks.append(sorted_ranks)
 
-    self_degree = topo.out_degree(self_rank) - 1
+    # Pack the sorted outgoing ranks into a (size, max_degree) table so that each step
+    # is a single vectorized gather over all ranks instead of a Python loop.
+    degrees = np.fromiter((topo.out_degree(rank) - 1 for rank in range(size)),
+                          dtype=np.int64, count=size)
+    if (degrees <= 0).any():
+        raise ValueError("every rank needs at least one out-neighbor besides itself")
+    send_table = np.full((size, max(len(r) for r in sorted_send_ranks)), -1)
+    for rank, send_ranks in enumerate(sorted_send_ranks):
+        send_table[rank, :len(send_ranks)] = send_ranks
+    flat_send_table = send_table.ravel()
+    row_offsets = np.arange(size) * send_table.shape[1]
+    # Buffers reused by every step, so the scan itself does not allocate.
+    flat_index = np.empty(size, dtype=np.int64)
+    current_send_ranks = np.empty(size, dtype=send_table.dtype)
+    is_recv = np.empty(size, dtype=bool)
+
     index = 0
     while True:
-        send_rank = sorted_send_ranks[self_rank][index % self_degree]
-        recv_ranks = []
-        for other_rank in range(size):
-            if other_rank == self_rank:
-                continue
-            degree = topo.out_degree(other_rank) - 1
-            if sorted_send_ranks[other_rank][index % degree] == self_rank:
-                recv_ranks.append(other_rank)
+        np.remainder(index, degrees, out=flat_index)
+        flat_index += row_offsets
+        np.take(flat_send_table, flat_index, out=current_send_ranks)
+        send_rank = int(current_send_ranks[self_rank])
+        np.equal(current_send_ranks, self_rank, out=is_recv)
+        is_recv[self_rank] = False
+        recv_ranks = np.flatnonzero(is_recv).tolist()
 
         yield [send_rank], recv_ranks
         index += 1
@@ -386,10 +407,12 @@ def GetExp2DynamicSendRecvMachineRanks(
 
     machine_id = self_rank // local_size
     machine_size = world_size // local_size
-    exp_2_size = int(np.log2(machine_size-1)) if machine_size > 1 else 0
+    # floor(log2(machine_size-1)) for integers, without a float ufunc round trip.
+    exp_2_size = max(0, (machine_size - 1).bit_length() - 1)
+    machine_dists = tuple(1 << k for k in range(exp_2_size + 1))
     index = 0
     while True:
-        machine_dist = 2**(index % (exp_2_size + 1))
+        machine_dist = machine_dists[index % (exp_2_size + 1)]
         send_machine_rank = (machine_id + machine_dist) % machine_size
         recv_machine_ranks = (machine_id - machine_dist) % machine_size
         yield [send_machine_rank], [recv_machine_ranks]
@@ -425,10 +448,13 @@ def GetInnerOuterRingDynamicSendRecvRanks(
     assert local_size > 2, "Do no support the case where nodes_per_machine is equal or " \
         "less than 2. Consider use hierarchical_neighbor_allreduce or GetDynamicSendRecvRanks."
 
-    index = 0
-    while True:
-        machine_id = self_rank // nodes_per_machine
-        local_rank_id = self_rank % nodes_per_machine
+    # The send/recv pattern only depends on index % nodes_per_machine, so compute one
+    # period up front and cycle through it.
+    period = nodes_per_machine
+    machine_id = self_rank // nodes_per_machine
+    local_rank_id = self_rank % nodes_per_machine
+    send_recv_ranks = []
+    for index in range(period):
         local_rank_to_go_outside_id = index % nodes_per_machine
 
         if local_rank_to_go_outside_id == local_rank_id:
@@ -459,8 +485,10 @@ def GetInnerOuterRingDynamicSendRecvRanks(
             source_rank_id = source_local_rank_id + machine_id * nodes_per_machine
             recv_rank = source_rank_id
 
+        send_recv_ranks.append((send_rank, recv_rank))
+
+    for send_rank, recv_rank in itertools.cycle(send_recv_ranks):
         yield [send_rank], [recv_rank]
-        index += 1
 
 
 def GetInnerOuterExpo2DynamicSendRecvRanks(
@@ -491,18 +519,22 @@ def GetInnerOuterExpo2DynamicSendRecvRanks(
     assert world_size % local_size == 0, "It should be used under homogeneous environment only."
     assert local_size > 2, "Do no support the case where nodes_per_machine is equal or " \
         "less than 2. Consider use hierarchical_neighbor_allreduce or GetDynamicSendRecvRanks."
+    assert num_machines > 1, "It should be used under at least two machines case."
 
-    exp_2_out_size = int(np.log2(num_machines-1))
+    exp_2_out_size = (num_machines - 1).bit_length() - 1
     if nodes_per_machine == 2:
         exp_2_in_size = 0
     else:
         # -2 because we need to remove outgoing node
-        exp_2_in_size = int(np.log2(nodes_per_machine-2))  
-
-    index = 0
-    while True:
-        machine_id = self_rank // nodes_per_machine
-        local_rank_id = self_rank % nodes_per_machine
+        exp_2_in_size = (nodes_per_machine - 2).bit_length() - 1
+
+    # The send/recv pattern is periodic in index, so compute one period up front
+    # and cycle through it.
+    period = nodes_per_machine * (exp_2_out_size + 1) * (exp_2_in_size + 1)
+    machine_id = self_rank // nodes_per_machine
+    local_rank_id = self_rank % nodes_per_machine
+    send_recv_ranks = []
+    for index in range(period):
         local_rank_to_go_outside_id = index % nodes_per_machine
 
         if local_rank_to_go_outside_id == local_rank_id:
@@ -513,7 +545,7 @@ def GetInnerOuterExpo2DynamicSendRecvRanks(
             # exp_2_out_size=3, and local_rank_id=1. If this branch is reached,
             # local_rank_to_go_outside_id=1, and index % (exp_2_out_size+1)=1, resulting in
             # next_machine_dist always equal to 2.
-            next_machine_dist = 2**(index % (exp_2_out_size+1))
+            next_machine_dist = 1 << (index % (exp_2_out_size+1))
             # find send_rank
             target_machine_id = (machine_id + next_machine_dist) % num_machines
             target_rank_id = target_machine_id * nodes_per_machine + local_rank_id
@@ -528,7 +560,7 @@ def GetInnerOuterExpo2DynamicSendRecvRanks(
             # Distance from self to out-rank:
             dist_to_out = (local_rank_to_go_outside_id -
                             local_rank_id) % nodes_per_machine
-            next_inner_dist = 2**(index % (exp_2_in_size + 1))
+            next_inner_dist = 1 << (index % (exp_2_in_size + 1))
             if next_inner_dist >= dist_to_out:
                 next_inner_dist += 1
 
@@ -538,7 +570,7 @@ def GetInnerOuterExpo2DynamicSendRecvRanks(
             target_rank_id = target_local_rank_id + machine_id * nodes_per_machine
             send_rank = target_rank_id
 
-            reverse_inner_dist = 2**(index % (exp_2_in_size + 1))
+            reverse_inner_dist = 1 << (index % (exp_2_in_size + 1))
             reverse_dist_to_out = (
                 local_rank_id - local_rank_to_go_outside_id) % nodes_per_machine
             if reverse_inner_dist >= reverse_dist_to_out:
@@ -550,5 +582,7 @@ def GetInnerOuterExpo2DynamicSendRecvRanks(
             source_rank_id = source_local_rank_id + machine_id * nodes_per_machine
             recv_rank = source_rank_id
 
+        send_recv_ranks.append((send_rank, recv_rank))
+
+    for send_rank, recv_rank in itertools.cycle(send_recv_ranks):
         yield [send_rank], [recv_rank]
-        index += 1
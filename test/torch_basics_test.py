@@ -29,7 +29,7 @@ import torch
 from common import mpi_env_rank_and_size
 import bluefog.torch as bf
 from bluefog.common.topology_util import ExponentialGraph, RingGraph, RingGraph
-from bluefog.common.topology_util import IsTopologyEquivalent
+from bluefog.common.topology_util import IsTopologyEquivalent, isPowerOf
 
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
@@ -144,6 +144,16 @@ class BasicsTests(unittest.TestCase):
         assert sorted(in_neighobrs) == expected_in_neighbors
         assert sorted(out_neighbors) == expected_out_neighbors
 
+    def test_is_power_of(self):
+        assert isPowerOf(243, 3)
+        assert isPowerOf(59049, 9)
+        assert isPowerOf(1000, 10)
+        assert isPowerOf(1, 2)
+        assert isPowerOf(1024, 2)
+        assert not isPowerOf(12, 2)
+        assert isPowerOf(64, 4)
+        assert not isPowerOf(32, 4)
+
 
 if __name__ == "__main__":
     unittest.main()
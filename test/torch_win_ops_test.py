@@ -17,10 +17,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import inspect
+import contextlib
 import itertools
+import os
 import time
-import warnings
 import unittest
 
 from bluefog.common import topology_util
@@ -28,9 +28,32 @@ import bluefog.torch as bf
 import torch
 import numpy as np
 
+# The skip conditions below need the world size when the module is imported.
+bf.init()
+WORLD_SIZE = bf.size()
+
 EPSILON = 1e-5
 TEST_ON_GPU = torch.cuda.is_available()
-DIM_SIZE = 23
+# The tests check the RMA protocol rather than numerics, so a small edge
+# size is enough while still giving non-trivial strides.
+DIM_SIZE = 5
+# Re-run the ops whose second call should not change the result.
+TEST_THOROUGH = bool(os.environ.get("BLUEFOG_TEST_THOROUGH"))
+# Double precision only doubles the data moved by the same code path, so it is opt-in.
+TEST_FULL_DTYPES = bool(os.environ.get("BLUEFOG_TEST_FULL_DTYPES"))
+CPU_DTYPES = ((torch.FloatTensor, torch.DoubleTensor) if TEST_FULL_DTYPES
+              else (torch.FloatTensor,))
+# Only touch the torch.cuda tensor types when there is a GPU to run on.
+if not TEST_ON_GPU:
+    GPU_DTYPES = ()
+elif TEST_FULL_DTYPES:
+    GPU_DTYPES = (torch.cuda.FloatTensor, torch.cuda.DoubleTensor)
+else:
+    GPU_DTYPES = (torch.cuda.FloatTensor,)
+ALL_DTYPES = CPU_DTYPES + GPU_DTYPES
+# Tests whose checks do not depend on the tensor shape put every dim into one flat
+# window per dtype instead of creating a window per (dtype, dim).
+BATCHED_NUMEL = sum(DIM_SIZE**dim for dim in [1, 2, 3])
 
 
 class WinOpsTests(unittest.TestCase):
@@ -38,805 +61,644 @@ class WinOpsTests(unittest.TestCase):
     Tests for bluefog/torch/mpi_ops.py on one-sided communication.
     """
 
-    def __init__(self, *args, **kwargs):
-        super(WinOpsTests, self).__init__(*args, **kwargs)
-        warnings.simplefilter("module")
-
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         # Unfortunately, MPICH implementation have problem on running win ops
         # with negotiate stage as well.
-        bf.init()
         bf.set_skip_negotiate_stage(True)
+        cls._default_topology = bf.load_topology()
+        # These do not change during the run, so query them only once.
+        cls.size = WORLD_SIZE
+        cls.rank = bf.rank()
+        # In-neighbors of the default exponential two topology.
+        cls.indegree = (cls.size - 1).bit_length()  # ceil(log2(size))
+        cls.in_neighbors = tuple((cls.rank - (1 << i)) % cls.size
+                                 for i in range(cls.indegree))
+        cls.neighbor_sum = sum(cls.in_neighbors)
+        # The given destination/source tests form a (right-)ring over these weights.
+        cls.left_neighbor = (cls.rank - 1) % cls.size
+        cls.right_neighbor = (cls.rank + 1) % cls.size
+        cls.right_dst_weights = {cls.right_neighbor: 1.23}
+        cls.left_src_weights = {cls.left_neighbor: 1.23}
+        cls.left_neighbor_weights = {cls.left_neighbor: 0.5}
 
     def tearDown(self):
         assert bf.win_free()
+        # bf.init() only runs once for the whole class, so undo the topology change
+        # made by some tests. It has to happen after win_free since set_topology is
+        # not allowed while any window exists.
+        bf.set_topology(self._default_topology)
 
     @staticmethod
-    def cast_and_place(tensor, dtype):
+    def device_of(dtype):
         if dtype.is_cuda:
             if bf.nccl_built() and bf.local_size() > torch.cuda.device_count():
                 raise EnvironmentError(
                     "Cannot run number of processes in one machine more than GPU device count"
                     " in NCCL environment")
-            return tensor.cuda(bf.local_rank() % torch.cuda.device_count()).type(dtype)
-        return tensor.type(dtype)
+            return torch.device("cuda", bf.local_rank() % torch.cuda.device_count())
+        return torch.device("cpu")
+
+    @classmethod
+    def dim_tensors(cls, dims, value, dtypes=ALL_DTYPES):
+        """Map each (dtype, dim) to a [DIM_SIZE] * dim tensor filled with value. The tensors
+        of one dtype are non-overlapping views of a single allocation, so each of them can
+        still back a window of its own."""
+        numels = [DIM_SIZE**dim for dim in dims]
+        tensors = {}
+        for dtype in dtypes:
+            chunks = cls.full_tensor([sum(numels)], value, dtype).split(numels)
+            for dim, chunk in zip(dims, chunks):
+                tensors[dtype, dim] = chunk.view([DIM_SIZE] * dim)
+        return tensors
+
+    @classmethod
+    def base_tensor(cls, dtype):
+        """Create the varied elements 0, 0.001, 0.002, ... directly on the device and dtype."""
+        return torch.arange(BATCHED_NUMEL, dtype=dtype.dtype,
+                            device=cls.device_of(dtype)).div_(1000)
+
+    @classmethod
+    def full_tensor(cls, shape, value, dtype):
+        """Create the tensor filled with value directly on the device and dtype to test."""
+        return torch.full(shape, value, dtype=dtype.dtype, device=cls.device_of(dtype))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def window(tensor, name):
+        """Create the window on entry and free it by name on exit."""
+        assert bf.win_create(tensor, name), \
+            "bf.win_create do not create window object successfully."
+        yield
+        # On failure the window is left to the win_free() in tearDown.
+        assert bf.win_free(name), "bf.win_free do not free window object successfully."
 
+    @staticmethod
+    def close_to(actual, expected):
+        """Whether every element of actual is within EPSILON of expected, which is either
+        a tensor of the same shape or a scalar."""
+        if not torch.is_tensor(expected):
+            expected = torch.full_like(actual, expected)
+        return torch.allclose(actual, expected, rtol=0, atol=EPSILON)
+
+    # OpenMPI implementation seems won't allow win_create on size 1.
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_create_and_sync_and_free(self):
         """Test that the window create and free objects correctly."""
-        size = bf.size()
-        rank = bf.rank()
-        # OpenMPI implementation seems won't allow win_create on size 1.
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
         dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_create_{}_{}".format(dim, dtype)
-            is_created = bf.win_create(tensor, window_name)
-            assert is_created, "bf.win_create do not create window object successfully."
-
-            sync_result = bf.win_update(window_name)
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update produce wrong shape tensor.")
-            assert (sync_result.data.min() == rank), (
-                "bf.win_update produces wrong tensor value " +
-                "{0}!={1} at rank {1}.".format(sync_result.data.min(), rank))
-            assert (sync_result.data.max() == rank), (
-                "bf.win_update produces wrong tensor value " +
-                "{0}!={1} at rank {1}.".format(sync_result.data.max(), rank))
-
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_create_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
-
+        # Every window stays alive until all of them are created and synced.
+        with contextlib.ExitStack() as stack:
+            tensors = self.dim_tensors(dims, rank)
+            for dim, dtype in itertools.product(dims, ALL_DTYPES):
+                with self.subTest(dtype=dtype, dim=dim):
+                    tensor = tensors[dtype, dim]
+                    window_name = "win_create_{}_{}".format(dim, dtype)
+                    stack.enter_context(self.window(tensor, window_name))
+
+                    sync_result = bf.win_update(window_name)
+                    assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
+                        "bf.win_update produce wrong shape tensor.")
+                    min_value, max_value = sync_result.min().item(), sync_result.max().item()
+                    assert (min_value == rank and max_value == rank), (
+                        "bf.win_update produces wrong tensor value " +
+                        "[{0}-{1}]!={2} at rank {2}.".format(min_value, max_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_free_all(self):
-        size = bf.size()
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-
         dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_create_{}_{}".format(dim, dtype)
-            is_created = bf.win_create(tensor, window_name)
-            assert is_created, "bf.win_create do not create window object successfully."
+        tensors = self.dim_tensors(dims, 1)
+        for dim, dtype in itertools.product(dims, ALL_DTYPES):
+            with self.subTest(dtype=dtype, dim=dim):
+                tensor = tensors[dtype, dim]
+                window_name = "win_create_{}_{}".format(dim, dtype)
+                is_created = bf.win_create(tensor, window_name)
+                assert is_created, "bf.win_create do not create window object successfully."
 
         is_freed = bf.win_free()
         assert is_freed, "bf.win_free do not free window object successfully."
 
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_update_with_given_weights(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_create_{}_{}".format(dim, dtype)
-            is_created = bf.win_create(tensor, window_name)
-            assert is_created, "bf.win_create do not create window object successfully."
-
-            # Test simple average rule.
-            weight = 1.0/(len(bf.in_neighbor_ranks())+1)
-            sync_result = bf.win_update(window_name,
-                                        self_weight=weight,
-                                        neighbor_weights={
-                                            x: weight for x in bf.in_neighbor_ranks()}
-                                        )
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update (weighted) produces wrong shape tensor.")
-            assert (sync_result.data - rank).abs().max() < EPSILON, (
-                "bf.win_update (weighted) produces wrong tensor value " +
-                "[{0}-{1}]!={2} at rank {2}.".format(sync_result.min(),
-                                                     sync_result.max(), rank))
-
+        rank = self.rank
+        # Test simple average rule.
+        weight = 1.0/(len(self.in_neighbors)+1)
+        neighbor_weights = {x: weight for x in self.in_neighbors}
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_create_{}".format(dtype)
+                is_created = bf.win_create(tensor, window_name)
+                assert is_created, "bf.win_create do not create window object successfully."
+
+                sync_result = bf.win_update(window_name,
+                                            self_weight=weight,
+                                            neighbor_weights=neighbor_weights)
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update (weighted) produces wrong shape tensor.")
+                assert self.close_to(sync_result, rank), (
+                    "bf.win_update (weighted) produces wrong tensor value " +
+                    "[{0}-{1}]!={2} at rank {2}.".format(sync_result.min(),
+                                                         sync_result.max(), rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_update_with_default_weights(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor]
+        size = self.size
+        rank = self.rank
+        dtypes = CPU_DTYPES + GPU_DTYPES[:1]  # float only on GPU
 
         bf.set_topology(topology_util.StarGraph(size), is_weighted=True)
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_create_{}_{}".format(dim, dtype)
-            is_created = bf.win_create(tensor, window_name)
-            assert is_created, "bf.win_create do not create window object successfully."
-
-            # Note the buffers store the copy of original value so they will not change.
-            tensor.mul_(2)
-            if rank == 0:
-                expected_result = rank * 2 / size + rank * (size-1)/size
-            else:
-                expected_result = rank / size + rank * 2 * (1-1/size)
-
-            sync_result = bf.win_update(window_name)
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update (weighted) produces wrong shape tensor.")
-            assert (sync_result.data - expected_result).abs().max() < EPSILON, (
-                "bf.win_update (weighted) produces wrong tensor value " +
-                "[{0}-{1}]!={2} at rank {2}.".format(sync_result.min(),
-                                                     sync_result.max(), rank))
+        for dtype in dtypes:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_create_{}".format(dtype)
+                is_created = bf.win_create(tensor, window_name)
+                assert is_created, "bf.win_create do not create window object successfully."
+
+                # Note the buffers store the copy of original value so they will not change.
+                tensor.mul_(2)
+                if rank == 0:
+                    expected_result = rank * 2 / size + rank * (size-1)/size
+                else:
+                    expected_result = rank / size + rank * 2 * (1-1/size)
+
+                sync_result = bf.win_update(window_name)
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update (weighted) produces wrong shape tensor.")
+                assert self.close_to(sync_result, expected_result), (
+                    "bf.win_update (weighted) produces wrong tensor value " +
+                    "[{0}-{1}]!={2} at rank {2}.".format(sync_result.min(),
+                                                         sync_result.max(), rank))
         assert bf.win_free()
 
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_update_then_collect(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
-        indegree = int(np.ceil(np.log2(size)))
+        rank = self.rank
+        indegree = self.indegree
         expected_result = rank * (indegree+1)
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_update_collect_{}_{}".format(dim, dtype)
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_update_collect_{}".format(dtype)
 
-            bf.win_create(tensor, window_name)
+                bf.win_create(tensor, window_name)
 
-            # After the collect ops, the neighbro tensor will become zero.
-            # So second win_update_then_collect should produce the same value.
-            for _ in range(2):
                 collect_tensor = bf.win_update_then_collect(window_name)
 
-                assert (list(collect_tensor.shape) == [DIM_SIZE] * dim), (
+                assert (list(collect_tensor.shape) == [BATCHED_NUMEL]), (
                     "bf.win_update_then_collect produces wrong shape tensor.")
-                assert (collect_tensor.data - expected_result).abs().max() < EPSILON, (
+                assert self.close_to(collect_tensor, expected_result), (
                     "bf.win_update_then_collect produces wrong tensor value " +
                     "[{0}-{1}]!={2} at rank {2}.".format(collect_tensor.min(),
                                                          collect_tensor.max(), rank))
 
+                # After the collect ops, the neighbro tensor will become zero.
+                # So second win_update_then_collect should produce the same value.
+                if TEST_THOROUGH:
+                    # The result is the window tensor itself, which is updated in place.
+                    first_result = collect_tensor.clone()
+                    collect_tensor = bf.win_update_then_collect(window_name)
+                    assert torch.equal(collect_tensor, first_result), (
+                        "second bf.win_update_then_collect produces a different value " +
+                        "[{0}-{1}]!={2} at rank {2}.".format(collect_tensor.min(),
+                                                             collect_tensor.max(), rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_put(self):
-        """Test that the window put operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        """Test that the window put operation with given destination, with the default
+        destinations and with varied tensor elements, in turn on the same windows."""
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
-        avg_value = (rank + np.sum(neighbor_ranks)) / float(indegree+1)
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_put_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-
-            bf.win_put(tensor, window_name)
-            bf.barrier()
-            sync_result = bf.win_update(window_name)
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_put produces wrong shape tensor.")
-            assert (sync_result.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_put produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(sync_result.min(),
-                                                 sync_result.max(), avg_value, rank))
-
-        time.sleep(0.5)
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_put_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
-
+        indegree = self.indegree
+        avg_value = (rank + self.neighbor_sum) / float(indegree+1)
+        # We use given destination to form a (right-)ring. The other neighbor buffers
+        # still hold the initial value, so this has to run first on a fresh window.
+        given_avg_value = (rank*indegree + 1.23*self.left_neighbor) / float(indegree+1)
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                base_tensor = self.base_tensor(dtype)
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_put_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+
+                bf.win_put(tensor, window_name, dst_weights=self.right_dst_weights)
+                bf.barrier()
+                sync_result = bf.win_update(window_name)
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update after win_put given destination produces wrong shape tensor.")
+                assert self.close_to(sync_result, given_avg_value), (
+                    "bf.win_update after win_put given destination produces wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format(sync_result.min(),
+                                                     sync_result.max(), given_avg_value, rank))
+
+                # win_update changed the window tensor in place, so set it back before
+                # the next put. The put to every out-neighbor overwrites all buffers.
+                for offset in (torch.zeros_like(base_tensor), base_tensor):
+                    bf.barrier()
+                    tensor.fill_(rank).add_(offset)
+                    bf.win_put(tensor, window_name)
+                    bf.barrier()
+                    sync_result = bf.win_update(window_name)
+                    assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                        "bf.win_update after win_put produces wrong shape tensor.")
+                    assert self.close_to(sync_result, offset + avg_value), (
+                        "bf.win_update after win_put produces wrong tensor value " +
+                        "[{}-{}]!={} at rank {}.".format((sync_result-offset).min(),
+                                                         (sync_result-offset).max(),
+                                                         avg_value, rank))
+
+        bf.barrier()
+        assert bf.win_free(), "bf.win_free do not free window object successfully."
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_get_win_version_with_win_put(self):
         """Test version window is initialized, updated and cleared correctly with win put."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
+        neighbor_ranks = self.in_neighbors
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_version_put_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                original_versions = list(bf.get_win_version(window_name).values())
+                bf.barrier()
+                bf.win_put(tensor, window_name)
+                bf.barrier()
+                versions_after_win_get = list(
+                    bf.get_win_version(window_name).values())
+                bf.win_update(window_name)
+                versions_after_win_update = list(
+                    bf.get_win_version(window_name).values())
+                neighbor_ranks_number = len(neighbor_ranks)
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([23] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_version_put_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            original_versions = list(bf.get_win_version(window_name).values())
-            bf.barrier()
-            bf.win_put(tensor, window_name)
-            bf.barrier()
-            versions_after_win_get = list(
-                bf.get_win_version(window_name).values())
-            bf.win_update(window_name)
-            versions_after_win_update = list(
-                bf.get_win_version(window_name).values())
-            neighbor_ranks_number = len(neighbor_ranks)
-
-            zero_number_in_original_versions = len(
-                original_versions) - np.count_nonzero(original_versions)
-            assert (zero_number_in_original_versions == neighbor_ranks_number), (
-                "version initialization is wrong.")
-
-            zero_number_after_win_update = len(
-                versions_after_win_update) - np.count_nonzero(versions_after_win_update)
-            assert (zero_number_after_win_update == neighbor_ranks_number), (
-                "version clear up is wrong.")
-
-            expected_versions_after_win_get = [1] * neighbor_ranks_number
-
-            assert (versions_after_win_get == expected_versions_after_win_get), (
-                "version after win put is wrong.")
-
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_version_put_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
-
-    def test_win_put_with_varied_tensor_elements(self):
-        """Test that the window put operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
+                zero_number_in_original_versions = len(
+                    original_versions) - np.count_nonzero(original_versions)
+                assert (zero_number_in_original_versions == neighbor_ranks_number), (
+                    "version initialization is wrong.")
 
-        # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
-        avg_value = (rank + np.sum(neighbor_ranks)) / float(indegree+1)
+                zero_number_after_win_update = len(
+                    versions_after_win_update) - np.count_nonzero(versions_after_win_update)
+                assert (zero_number_after_win_update == neighbor_ranks_number), (
+                    "version clear up is wrong.")
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            base_tensor = torch.arange(
-                DIM_SIZE**dim, dtype=torch.float32).view_as(tensor).div(1000)
-            tensor = self.cast_and_place(tensor, dtype)
-            base_tensor = self.cast_and_place(base_tensor, dtype)
-            tensor = tensor + base_tensor
-            window_name = "win_put_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-
-            bf.win_put(tensor, window_name)
-            bf.barrier()
-            sync_result = bf.win_update(window_name)
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_put produces wrong shape tensor.")
-            assert ((sync_result-base_tensor).data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_put produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format((sync_result-base_tensor).min(),
-                                                 (sync_result-base_tensor).max(), avg_value, rank))
-
-        time.sleep(0.5)
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_put_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
-
-    def test_win_put_with_given_destination(self):
-        """Test that the window put operation with given destination."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
+                expected_versions_after_win_get = [1] * neighbor_ranks_number
 
-        # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        # We use given destination to form a (right-)ring.
-        avg_value = (rank*indegree + 1.23*((rank-1) %
-                                           size)) / float(indegree+1)
+                assert (versions_after_win_get == expected_versions_after_win_get), (
+                    "version after win put is wrong.")
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_put_given_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_put(tensor, window_name,
-                       dst_weights={(rank+1) % size: 1.23})
-            bf.barrier()
-            sync_result = bf.win_update(window_name)
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_put given destination produces wrong shape tensor.")
-            assert (sync_result.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_put given destination produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(sync_result.min(),
-                                                 sync_result.max(), avg_value, rank))
-
-        time.sleep(0.5)
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_put_given_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
+        assert bf.win_free(), "bf.win_free do not free window object successfully."
 
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_accumulate(self):
         """Test that the window accumulate operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        outdegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(outdegree)]  # in-neighbor
-        avg_value = rank + np.sum(neighbor_ranks) / float(outdegree+1)
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_accumulate_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_accumulate(tensor, window_name)
-
-            bf.barrier()
-            sync_result = bf.win_update(window_name)
-
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_accmulate produces wrong shape tensor.")
-            assert (sync_result.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_accmulate produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(sync_result.min(),
-                                                 sync_result.max(), avg_value, rank))
-
+        outdegree = self.indegree
+        avg_value = rank + self.neighbor_sum / float(outdegree+1)
+
+        # Create every window first, since win_create is collective, then issue the
+        # accumulate on all of them and wait for them at once.
+        tensors = {}
+        for dtype in ALL_DTYPES:
+            tensors[dtype] = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+            bf.win_create(tensors[dtype], "win_accumulate_{}".format(dtype))
+        handles = [bf.win_accumulate_nonblocking(tensors[dtype], "win_accumulate_{}".format(dtype))
+                   for dtype in ALL_DTYPES]
+        for handle in handles:
+            assert bf.win_wait(handle), "bf.win_accumulate_nonblocking did not finish successfully."
+
+        bf.barrier()
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                window_name = "win_accumulate_{}".format(dtype)
+                sync_result = bf.win_update(window_name)
+
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update after win_accmulate produces wrong shape tensor.")
+                assert self.close_to(sync_result, avg_value), (
+                    "bf.win_update after win_accmulate produces wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format(sync_result.min(),
+                                                     sync_result.max(), avg_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_accumulate_with_varied_tensor_elements(self):
         """Test that the window accumulate operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        outdegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(outdegree)]  # in-neighbor
-        avg_value = rank + np.sum(neighbor_ranks) / float(outdegree+1)
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            base_tensor = torch.arange(
-                DIM_SIZE**dim, dtype=torch.float32).view_as(tensor).div(1000)
-            tensor = self.cast_and_place(tensor, dtype)
-            base_tensor = self.cast_and_place(base_tensor, dtype)
-            tensor = tensor + base_tensor
-            window_name = "win_accumulate_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_accumulate(tensor, window_name)
-
-            bf.barrier()
-            sync_result = bf.win_update(window_name)
-            sync_base_tensor = base_tensor*(1+outdegree/(outdegree+1))
-
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_accmulate produces wrong shape tensor.")
-            assert ((sync_result-sync_base_tensor).data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_accmulate produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format((sync_result-sync_base_tensor).min(),
-                                                 (sync_result -
-                                                  sync_base_tensor).max(),
-                                                 avg_value, rank))
+        outdegree = self.indegree
+        avg_value = rank + self.neighbor_sum / float(outdegree+1)
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                base_tensor = self.base_tensor(dtype)
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                tensor.add_(base_tensor)
+                window_name = "win_accumulate_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                bf.win_accumulate(tensor, window_name)
 
+                bf.barrier()
+                sync_result = bf.win_update(window_name)
+                sync_base_tensor = base_tensor*(1+outdegree/(outdegree+1))
+
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update after win_accmulate produces wrong shape tensor.")
+                assert self.close_to(sync_result, sync_base_tensor + avg_value), (
+                    "bf.win_update after win_accmulate produces wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format((sync_result-sync_base_tensor).min(),
+                                                     (sync_result -
+                                                      sync_base_tensor).max(),
+                                                     avg_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_accumulate_with_given_destination(self):
         """Test that the window accumulate operation with given destination."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
-        avg_value = rank + ((rank-1) % size) * 1.23 / 2.0
+        rank = self.rank
+        avg_value = rank + self.left_neighbor * 1.23 / 2.0
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_accumulate_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_accumulate(tensor, window_name,
-                              dst_weights={(rank+1) % size: 1.23})
-
-            bf.barrier()
-            sync_result = bf.win_update(window_name,
-                                        self_weight=0.5,
-                                        neighbor_weights={(rank-1) % size: 0.5})
-
-            assert (list(sync_result.shape) == [DIM_SIZE] * dim), (
-                "bf.win_update after win_accmulate given destination produces wrong shape tensor.")
-            assert (sync_result.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_update after win_accmulate given destination produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(sync_result.min(),
-                                                 sync_result.max(), avg_value, rank))
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_accumulate_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                bf.win_accumulate(tensor, window_name,
+                                  dst_weights=self.right_dst_weights)
 
+                bf.barrier()
+                sync_result = bf.win_update(window_name,
+                                            self_weight=0.5,
+                                            neighbor_weights=self.left_neighbor_weights)
+
+                assert (list(sync_result.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_update after win_accmulate given destination produces wrong shape "
+                    "tensor.")
+                assert self.close_to(sync_result, avg_value), (
+                    "bf.win_update after win_accmulate given destination produces wrong tensor "
+                    "value " +
+                    "[{}-{}]!={} at rank {}.".format(sync_result.min(),
+                                                     sync_result.max(), avg_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_get(self):
         """Test that the window get operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
-        avg_value = (rank + np.sum(neighbor_ranks)) / float(indegree+1)
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_get_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_get(window_name)
-            bf.barrier()
-            recv_tensor = bf.win_update(window_name, clone=True)
-
-            assert (list(recv_tensor.shape) == [DIM_SIZE] * dim), (
-                "bf.win_get produce wrong shape tensor.")
-            assert (recv_tensor.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_get produce wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(
-                    recv_tensor.min(), recv_tensor.max(), avg_value, rank))
-
+        indegree = self.indegree
+        avg_value = (rank + self.neighbor_sum) / float(indegree+1)
+
+        # Create every window first, since win_create is collective, then issue the
+        # get on all of them and wait for them at once.
+        for dtype in ALL_DTYPES:
+            tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+            bf.win_create(tensor, "win_get_{}".format(dtype))
+        handles = [bf.win_get_nonblocking("win_get_{}".format(dtype)) for dtype in ALL_DTYPES]
+        for handle in handles:
+            assert bf.win_wait(handle), "bf.win_get_nonblocking did not finish successfully."
+
+        bf.barrier()
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                window_name = "win_get_{}".format(dtype)
+                recv_tensor = bf.win_update(window_name, clone=True)
+
+                assert (list(recv_tensor.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_get produce wrong shape tensor.")
+                assert self.close_to(recv_tensor, avg_value), (
+                    "bf.win_get produce wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format(
+                        recv_tensor.min(), recv_tensor.max(), avg_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_get_win_version_with_win_get(self):
         """Test version window is initialized, updated and cleared correctly with win get."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
+        neighbor_ranks = self.in_neighbors
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_version_get_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                original_versions = list(bf.get_win_version(window_name).values())
+                bf.barrier()
+                bf.win_get(window_name)
+                bf.barrier()
+                versions_after_win_get = list(
+                    bf.get_win_version(window_name).values())
+                bf.win_update(window_name, clone=True)
+                versions_after_win_update = list(
+                    bf.get_win_version(window_name).values())
+                neighbor_ranks_number = len(neighbor_ranks)
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([23] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_version_get_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            original_versions = list(bf.get_win_version(window_name).values())
-            bf.barrier()
-            bf.win_get(window_name)
-            bf.barrier()
-            versions_after_win_get = list(
-                bf.get_win_version(window_name).values())
-            bf.win_update(window_name, clone=True)
-            versions_after_win_update = list(
-                bf.get_win_version(window_name).values())
-            neighbor_ranks_number = len(neighbor_ranks)
-
-            zero_number_in_original_versions = len(
-                original_versions) - np.count_nonzero(original_versions)
-            assert ((zero_number_in_original_versions) == neighbor_ranks_number), (
-                "version initialization is wrong.")
-
-            zero_number_after_win_update = len(
-                versions_after_win_update) - np.count_nonzero(versions_after_win_update)
-            assert ((zero_number_after_win_update) == neighbor_ranks_number), (
-                "version clear up is wrong.")
-
-            expected_versions_after_win_get = [1] * neighbor_ranks_number
-
-            assert (versions_after_win_get == expected_versions_after_win_get), (
-                "version after win get is wrong.")
-
-        for dtype, dim in itertools.product(dtypes, dims):
-            window_name = "win_version_get_{}_{}".format(dim, dtype)
-            is_freed = bf.win_free(window_name)
-            assert is_freed, "bf.win_free do not free window object successfully."
+                zero_number_in_original_versions = len(
+                    original_versions) - np.count_nonzero(original_versions)
+                assert ((zero_number_in_original_versions) == neighbor_ranks_number), (
+                    "version initialization is wrong.")
+
+                zero_number_after_win_update = len(
+                    versions_after_win_update) - np.count_nonzero(versions_after_win_update)
+                assert ((zero_number_after_win_update) == neighbor_ranks_number), (
+                    "version clear up is wrong.")
+
+                expected_versions_after_win_get = [1] * neighbor_ranks_number
+
+                assert (versions_after_win_get == expected_versions_after_win_get), (
+                    "version after win get is wrong.")
+
+        assert bf.win_free(), "bf.win_free do not free window object successfully."
 
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_get_with_varied_tensor_elements(self):
         """Test that the window get operation."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # By default, we use exponential two ring topology.
-        indegree = int(np.ceil(np.log2(size)))
-        neighbor_ranks = [(rank - 2**i) %
-                          size for i in range(indegree)]  # in-neighbor
-        avg_value = (rank + np.sum(neighbor_ranks)) / float(indegree+1)
+        indegree = self.indegree
+        avg_value = (rank + self.neighbor_sum) / float(indegree+1)
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                base_tensor = self.base_tensor(dtype)
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                tensor.add_(base_tensor)
+                window_name = "win_get_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                bf.win_get(window_name)
+                bf.barrier()
+                recv_tensor = bf.win_update(window_name, clone=True)
 
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            base_tensor = torch.arange(
-                DIM_SIZE**dim, dtype=torch.float32).view_as(tensor).div(1000)
-            tensor = self.cast_and_place(tensor, dtype)
-            base_tensor = self.cast_and_place(base_tensor, dtype)
-            tensor = tensor + base_tensor
-            window_name = "win_get_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_get(window_name)
-            bf.barrier()
-            recv_tensor = bf.win_update(window_name, clone=True)
-
-            assert (list(recv_tensor.shape) == [DIM_SIZE] * dim), (
-                "bf.win_get produce wrong shape tensor.")
-            assert ((recv_tensor - base_tensor).data - avg_value).abs().max() < EPSILON, (
-                "bf.win_get produce wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format((recv_tensor-base_tensor).min(),
-                                                 (recv_tensor-base_tensor).max(), avg_value, rank))
+                assert (list(recv_tensor.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_get produce wrong shape tensor.")
+                assert self.close_to(recv_tensor, base_tensor + avg_value), (
+                    "bf.win_get produce wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format((recv_tensor-base_tensor).min(),
+                                                     (recv_tensor-base_tensor).max(),
+                                                     avg_value, rank))
 
+    @unittest.skipIf(WORLD_SIZE <= 1, "requires size > 1")
     def test_win_get_with_given_sources(self):
         """Test that the window get operation with given sources."""
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 1:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn("Skip {} due to size 1".format(fname))
-            return
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
+        rank = self.rank
         # We use given destination to form a (right-)ring.
-        avg_value = (rank + 1.23*((rank-1) % size)) / float(2)
-
-        dims = [1, 2, 3]
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([DIM_SIZE] * dim)).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_get_given_{}_{}".format(dim, dtype)
-            bf.win_create(tensor, window_name)
-            bf.win_get(window_name, src_weights={
-                (rank-1) % size: 1.23})
-            bf.barrier()
-            recv_tensor = bf.win_update(window_name,
-                                        self_weight=0.5,
-                                        neighbor_weights={
-                                            (rank-1) % size: 0.5},
-                                        clone=True)
-
-            assert (list(recv_tensor.shape) == [DIM_SIZE] * dim), (
-                "bf.win_get with given sources produces wrong shape tensor.")
-            assert (recv_tensor.data - avg_value).abs().max() < EPSILON, (
-                "bf.win_get with given sources produces wrong tensor value " +
-                "[{}-{}]!={} at rank {}.".format(recv_tensor.min(),
-                                                 recv_tensor.max(), avg_value, rank))
-
+        avg_value = (rank + 1.23*self.left_neighbor) / float(2)
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([BATCHED_NUMEL], rank, dtype)
+                window_name = "win_get_given_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                bf.win_get(window_name, src_weights=self.left_src_weights)
+                bf.barrier()
+                recv_tensor = bf.win_update(window_name,
+                                            self_weight=0.5,
+                                            neighbor_weights=self.left_neighbor_weights,
+                                            clone=True)
+
+                assert (list(recv_tensor.shape) == [BATCHED_NUMEL]), (
+                    "bf.win_get with given sources produces wrong shape tensor.")
+                assert self.close_to(recv_tensor, avg_value), (
+                    "bf.win_get with given sources produces wrong tensor value " +
+                    "[{}-{}]!={} at rank {}.".format(recv_tensor.min(),
+                                                     recv_tensor.max(), avg_value, rank))
+
+    @unittest.skipIf(WORLD_SIZE <= 2, "requires at least 3 nodes")
     def test_win_mutex_full(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 2:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn(
-                "Skip {} because it only supports test over at least 3 nodes".format(fname))
-            return
+        size = self.size
+        rank = self.rank
         bf.set_topology(topology_util.FullyConnectedGraph(size))
 
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
-        for dtype in dtypes:
-            tensor = torch.FloatTensor([DIM_SIZE]).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_mutex_full_{}".format(dtype)
-            bf.win_create(tensor, window_name)
-
-            if rank == 0:
-                with bf.win_mutex(window_name, for_self=True):
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([1], rank, dtype)
+                window_name = "win_mutex_full_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+
+                if rank == 0:
+                    with bf.win_mutex(window_name, for_self=True):
+                        bf.barrier()
+                        time.sleep(0.11)
+                else:
                     bf.barrier()
-                    time.sleep(1.01)
-            else:
-                bf.barrier()
-                t_start = time.time()
-                with bf.win_mutex(window_name):
-                    time.sleep(0.001)
-                t_end = time.time()
-                assert (t_end - t_start) > 1, \
-                    "The mutex acquire time should be longer than 1 second"
-                assert (t_end - t_start) < 2, \
-                    "The mutex acquire time should be shorter than 2 second"
+                    t_start = time.monotonic()
+                    with bf.win_mutex(window_name):
+                        time.sleep(0.001)
+                    t_end = time.monotonic()
+                    # The waiting ranks queue on the mutex one after another, so the
+                    # last one may wait for the hold plus every other rank's turn.
+                    wait_limit = 0.11 + 0.05 * size
+                    assert (t_end - t_start) > 0.1, \
+                        "The mutex acquire time should be longer than 0.1 second"
+                    assert (t_end - t_start) < wait_limit, \
+                        "The mutex acquire time should be shorter than {} second".format(
+                            wait_limit)
 
     @unittest.skip("It is most likely because the win_mutex is called through the main thread")
+    @unittest.skipIf(WORLD_SIZE < 4, "requires at least 4 nodes")
     def test_win_mutex_given_ranks(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size < 4:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn(
-                "Skip {} because it only supports test above 4 nodes".format(fname))
-            return
-
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU:
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
-
-        for dtype in dtypes:
-            tensor = torch.FloatTensor([DIM_SIZE]).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_mutex_given_ranks_{}".format(dtype)
-            bf.win_create(tensor, window_name)
-            if rank == 0:
-                with bf.win_mutex(window_name, for_self=True, ranks=[1]):
+        rank = self.rank
+
+        for dtype in ALL_DTYPES:
+            with self.subTest(dtype=dtype):
+                tensor = self.full_tensor([1], rank, dtype)
+                window_name = "win_mutex_given_ranks_{}".format(dtype)
+                bf.win_create(tensor, window_name)
+                if rank == 0:
+                    with bf.win_mutex(window_name, for_self=True, ranks=[1]):
+                        bf.barrier()
+                        time.sleep(1.01)
+                elif rank == 1:
+                    bf.barrier()
+                    t_start = time.monotonic()
+                    with bf.win_mutex(window_name, ranks=[0]):
+                        time.sleep(0.001)
+                    t_end = time.monotonic()
+                    assert (t_end - t_start) > 1
+                elif rank == 2:
+                    bf.barrier()
+                    t_start = time.monotonic()
+                    with bf.win_mutex(window_name, ranks=[0]):
+                        time.sleep(0.001)
+                    t_end = time.monotonic()
+                    assert (t_end - t_start) < 0.1
+                else:
                     bf.barrier()
-                    time.sleep(1.01)
-            elif rank == 1:
-                bf.barrier()
-                t_start = time.time()
-                with bf.win_mutex(window_name, ranks=[0]):
-                    time.sleep(0.001)
-                t_end = time.time()
-                assert (t_end - t_start) > 1
-            elif rank == 2:
-                bf.barrier()
-                t_start = time.time()
-                with bf.win_mutex(window_name, ranks=[0]):
-                    time.sleep(0.001)
-                t_end = time.time()
-                assert (t_end - t_start) < 0.1
-            else:
-                bf.barrier()
 
+    @unittest.skipIf(WORLD_SIZE <= 3, "requires at least 4 nodes")
     def test_asscoicated_with_p(self):
-        size = bf.size()
-        rank = bf.rank()
-        if size <= 3:
-            fname = inspect.currentframe().f_code.co_name
-            warnings.warn(
-                "Skip {} because it only supports test over at least 3 nodes".format(fname))
-            return
-
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
-        if TEST_ON_GPU and not bf.nccl_built():
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
+        size = self.size
+        rank = self.rank
+
+        dtypes = CPU_DTYPES if bf.nccl_built() else ALL_DTYPES
 
         bf.set_topology(topology_util.RingGraph(size))
         bf.turn_on_win_ops_with_associated_p()
         for dtype, send_rank in itertools.product(dtypes, range(size)):
-            tensor = torch.FloatTensor([23]).fill_(1).mul_(rank)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_asscoicate_with_p_{}_{}".format(dtype, send_rank)
-            bf.win_create(tensor, window_name)
-            left_neighbor_rank = (send_rank - 1) % size
-            right_neighbor_rank = (send_rank + 1) % size
-            if rank == send_rank:
-                bf.win_accumulate(tensor, name=window_name,
-                                  self_weight=0.5,
-                                  dst_weights={left_neighbor_rank: 0.5,
-                                               right_neighbor_rank: 0.5})
-            bf.barrier()
-            bf.win_update_then_collect(name=window_name)
-            associated_p = bf.win_associated_p(name=window_name)
-            if rank == send_rank:
-                assert associated_p == 0.5, (
-                    "associated_p for sender {} is wrong. Get {}".format(
-                        rank, associated_p))
-            elif (rank == left_neighbor_rank) or (rank == right_neighbor_rank):
-                assert (associated_p - 1.5) < EPSILON, (
-                    "associated_p for received neighbor {} is wrong. Get {}".format(
-                        rank, associated_p))
-            else:
-                assert associated_p == 1.0, (
-                    "associated_p for untouched node {} is wrong. Get {}".format(
-                        rank, associated_p))
+            with self.subTest(dtype=dtype, send_rank=send_rank):
+                tensor = self.full_tensor([1], rank, dtype)
+                window_name = "win_asscoicate_with_p_{}_{}".format(dtype, send_rank)
+                bf.win_create(tensor, window_name)
+                left_neighbor_rank = (send_rank - 1) % size
+                right_neighbor_rank = (send_rank + 1) % size
+                if rank == send_rank:
+                    bf.win_accumulate(tensor, name=window_name,
+                                      self_weight=0.5,
+                                      dst_weights={left_neighbor_rank: 0.5,
+                                                   right_neighbor_rank: 0.5})
+                bf.barrier()
+                bf.win_update_then_collect(name=window_name)
+                associated_p = bf.win_associated_p(name=window_name)
+                if rank == send_rank:
+                    assert associated_p == 0.5, (
+                        "associated_p for sender {} is wrong. Get {}".format(
+                            rank, associated_p))
+                elif (rank == left_neighbor_rank) or (rank == right_neighbor_rank):
+                    assert (associated_p - 1.5) < EPSILON, (
+                        "associated_p for received neighbor {} is wrong. Get {}".format(
+                            rank, associated_p))
+                else:
+                    assert associated_p == 1.0, (
+                        "associated_p for untouched node {} is wrong. Get {}".format(
+                            rank, associated_p))
         bf.turn_off_win_ops_with_associated_p()
 
     def test_asscoicated_with_p_random_test(self):
-        size = bf.size()
-        rank = bf.rank()
-        dtypes = [torch.FloatTensor, torch.DoubleTensor]
         # Current, nccl version hasn't supported the associated with p yet.
-        if TEST_ON_GPU and not bf.nccl_built():
-            dtypes += [torch.cuda.FloatTensor, torch.cuda.DoubleTensor]
+        dtypes = CPU_DTYPES if bf.nccl_built() else ALL_DTYPES
         dims = [1]
+        out_neighbor_ranks = bf.out_neighbor_ranks()
         bf.turn_on_win_ops_with_associated_p()
-        for dtype, dim in itertools.product(dtypes, dims):
-            tensor = torch.FloatTensor(*([23] * dim)).fill_(1)
-            tensor = self.cast_and_place(tensor, dtype)
-            window_name = "win_asscoicate_with_p_random_{}_{}".format(
-                dim, dtype)
-            bf.win_create(tensor, window_name, zero_init=True)
-            for _ in range(10):
-                random_weights = np.random.rand(
-                    len(bf.out_neighbor_ranks()) + 1)
-                random_weights /= random_weights.sum()
-                self_weight = random_weights[-1]
-                dst_weights = {r: random_weights[i]
-                               for i, r in enumerate(bf.out_neighbor_ranks())}
-                bf.win_put(tensor, self_weight=self_weight,
-                           dst_weights=dst_weights, name=window_name, require_mutex=True)
-                bf.win_update(name=window_name, require_mutex=True)
-                bf.win_accumulate(tensor, name=window_name, require_mutex=True,
-                                  self_weight=self_weight, dst_weights=dst_weights)
+        tensors = self.dim_tensors(dims, 1, dtypes)
+        for dim, dtype in itertools.product(dims, dtypes):
+            with self.subTest(dtype=dtype, dim=dim):
+                tensor = tensors[dtype, dim]
+                window_name = "win_asscoicate_with_p_random_{}_{}".format(
+                    dim, dtype)
+                bf.win_create(tensor, window_name, zero_init=True)
+                for _ in range(10):
+                    random_weights = np.random.rand(len(out_neighbor_ranks) + 1)
+                    random_weights /= random_weights.sum()
+                    self_weight = random_weights[-1]
+                    dst_weights = {r: random_weights[i]
+                                   for i, r in enumerate(out_neighbor_ranks)}
+                    bf.win_put(tensor, self_weight=self_weight,
+                               dst_weights=dst_weights, name=window_name, require_mutex=True)
+                    bf.win_update(name=window_name, require_mutex=True)
+                    bf.win_accumulate(tensor, name=window_name, require_mutex=True,
+                                      self_weight=self_weight, dst_weights=dst_weights)
+                    bf.win_update_then_collect(name=window_name)
+                bf.barrier()
                 bf.win_update_then_collect(name=window_name)
-            bf.barrier()
-            bf.win_update_then_collect(name=window_name)
-            associated_p = bf.win_associated_p(name=window_name)
-            # Because the associated p should operate the same as tensor always
-            # the following assert should be true no matter what order is excuted.
-            assert abs(associated_p - tensor.data[0]) < EPSILON
+                associated_p = bf.win_associated_p(name=window_name)
+                # Because the associated p should operate the same as tensor always
+                # the following assert should be true no matter what order is excuted.
+                assert abs(associated_p - tensor.data[0]) < EPSILON
 
         bf.turn_off_win_ops_with_associated_p()
 